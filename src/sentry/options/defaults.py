@@ -187,6 +187,8 @@ register("snuba.search.chunk-growth-rate", default=1.5)
 register("snuba.search.max-chunk-size", default=2000)
 register("snuba.search.max-total-chunk-time-seconds", default=30.0)
 register("snuba.search.hits-sample-size", default=100)
+register("snuba.search.max-postfilter-set-size", default=6000)
+register("snuba.search.hits-cache-ttl", default=0)
 register("snuba.track-outcomes-sample-rate", default=0.0)
 
 # The percentage of tagkeys that we want to cache. Set to 1.0 in order to cache everything, <=0.0 to stop caching
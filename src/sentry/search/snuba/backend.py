@@ -111,11 +111,15 @@ def linked_filter(linked, projects):
 
 def first_release_all_environments_filter(version, projects):
     try:
-        release_id = Release.objects.get(
+        release_id = Release.objects.values_list("id", flat=True).get(
             organization=projects[0].organization_id, version=version
-        ).id
+        )
     except Release.DoesNotExist:
-        release_id = -1
+        # No group can have a release that doesn't exist as its first release.
+        # Django knows that an empty `IN` matches nothing, so querysets using
+        # this filter are resolved without querying Postgres at all, and the
+        # search returns before it ever gets to Snuba.
+        return Q(id__in=[])
     return Q(
         # If no specific environments are supplied, we look at the
         # first_release of any environment that the group has been
@@ -1,14 +1,19 @@
 from __future__ import absolute_import
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+from concurrent.futures import Future
 
 import logging
+import mmh3
 import time
 import six
 import sentry_sdk
+from copy import deepcopy
 from datetime import datetime, timedelta
-from hashlib import md5
+from operator import itemgetter
 
+from django.core.cache import cache
+from django.db.models import Model
 from django.utils import timezone
 
 from sentry import options
@@ -17,6 +22,8 @@ from sentry.api.paginator import DateTimePaginator, SequencePaginator, Paginator
 from sentry.constants import ALLOWED_FUTURE_DELTA
 from sentry.models import Group
 from sentry.utils import json, metrics, snuba
+from sentry.utils.dates import to_timestamp
+from sentry.utils.hashlib import md5_text
 
 
 def get_search_filter(search_filters, name, operator):
@@ -42,6 +49,34 @@ def get_search_filter(search_filters, name, operator):
     return found_val
 
 
+def get_date_bounds(search_filters):
+    """
+    Finds the most restrictive lower and upper bounds of the `date` search
+    filters in a single pass, equivalent to calling `get_search_filter` for
+    `date` with both '>' and '<'.
+    :param search_filters: collection of `SearchFilter` objects
+    :return: A tuple of (lower bound, upper bound), either of which is None if
+    not found
+    """
+    lower = upper = None
+    if not search_filters:
+        return lower, upper
+    for search_filter in search_filters:
+        if search_filter.key.name != "date":
+            continue
+        val = search_filter.value.raw_value
+        # Note that we check operator with `startswith` here so that we handle
+        # <, <=, >, >=
+        operator = search_filter.operator
+        if operator.startswith(">"):
+            if lower is None or val > lower:
+                lower = val
+        elif operator.startswith("<"):
+            if upper is None or val < upper:
+                upper = val
+    return lower, upper
+
+
 @six.add_metaclass(ABCMeta)
 class AbstractQueryExecutor:
     """This class serves as a template for Query Executors.
@@ -52,6 +87,11 @@ class AbstractQueryExecutor:
 
     TABLE_ALIAS = ""
 
+    # A dict of aggregation_def field name to its aggregation with the alias
+    # already appended, for the aggregations that don't depend on the query.
+    # They're tuples as they're shared by every query, which copies them.
+    compiled_aggregation_defs = {}
+
     @abstractproperty
     def aggregation_defs(self):
         """This method should return a dict of key:value
@@ -96,7 +136,48 @@ class AbstractQueryExecutor:
         We usually return a paginator object, which contains the results and the number of hits"""
         raise NotImplementedError
 
-    def snuba_search(
+    def snuba_search(self, **kwargs):
+        """
+        Returns a tuple of:
+        * a sorted list of (group_id, group_score) tuples sorted descending by score,
+        * the count of total results (rows) available for this query.
+
+        See `_get_snuba_search_query` for the accepted arguments.
+        """
+        snuba_results = snuba.aliased_query(**self._get_snuba_search_query(**kwargs))
+        return self._get_snuba_search_results(
+            snuba_results, kwargs["sort_field"], kwargs.get("get_sample", False)
+        )
+
+    def snuba_search_async(self, **kwargs):
+        """
+        Like `snuba_search`, but returns a `concurrent.futures.Future` for the
+        results so that the caller can do other work while Snuba runs the query.
+        """
+        result = Future()
+
+        def set_result(snuba_future):
+            if not result.set_running_or_notify_cancel():
+                return
+            try:
+                result.set_result(
+                    self._get_snuba_search_results(
+                        snuba_future.result(),
+                        kwargs["sort_field"],
+                        kwargs.get("get_sample", False),
+                    )
+                )
+            except Exception as e:
+                result.set_exception(e)
+
+        snuba_future = snuba.aliased_query_async(**self._get_snuba_search_query(**kwargs))
+        snuba_future.add_done_callback(set_result)
+        # Cancelling the result drops the Snuba request if it hasn't started
+        # yet. A request that is already in flight still runs to completion.
+        result.add_done_callback(lambda f: f.cancelled() and snuba_future.cancel())
+        return result
+
+    def _get_snuba_search_query(
         self,
         start,
         end,
@@ -109,11 +190,24 @@ class AbstractQueryExecutor:
         offset=0,
         get_sample=False,
         search_filters=None,
+        keyset=None,
+        conditions_and_having=None,
     ):
         """
-        Returns a tuple of:
-        * a sorted list of (group_id, group_score) tuples sorted descending by score,
-        * the count of total results (rows) available for this query.
+        Builds the parameters of the Snuba query for `snuba_search`.
+
+        `conditions_and_having` is an optional `(conditions, having)` tuple as
+        returned by `_build_conditions_and_having` for `search_filters`, so that
+        callers running several searches for the same filters only need to
+        convert them once.
+
+        `keyset` is an optional `(group_score, group_id)` tuple of the last row
+        returned by a previous search. When passed, only rows that sort after it
+        are returned, which lets callers page through results without making
+        Snuba scan and discard every row before an `offset`.
+
+        `group_ids` are passed to Snuba as is, so callers should sort them once
+        up front to keep the query (and so its cache key) stable.
         """
 
         filters = {"project_id": project_ids}
@@ -122,51 +216,71 @@ class AbstractQueryExecutor:
             filters["environment"] = environment_ids
 
         if group_ids:
-            filters["group_id"] = sorted(group_ids)
+            filters["group_id"] = group_ids
 
-        conditions = []
-        having = []
-        for search_filter in search_filters:
-            if (
-                # Don't filter on postgres fields here, they're not available
-                search_filter.key.name in self.postgres_only_fields
-                or
-                # We special case date
-                search_filter.key.name == "date"
-            ):
-                continue
-            converted_filter = convert_search_filter_to_snuba_query(search_filter)
-            converted_filter = self._transform_converted_filter(
-                search_filter, converted_filter, project_ids, environment_ids
+        if conditions_and_having is None:
+            conditions, having = self._build_conditions_and_having(
+                search_filters, project_ids, environment_ids
             )
-            if converted_filter is not None:
-                # Ensure that no user-generated tags that clashes with aggregation_defs is added to having
-                if search_filter.key.name in self.aggregation_defs and not search_filter.key.is_tag:
-                    having.append(converted_filter)
-                else:
-                    conditions.append(converted_filter)
+        else:
+            # The query is resolved and extended in place before it's sent to
+            # Snuba, so work on a copy of the conditions we were given.
+            conditions, having = deepcopy(conditions_and_having)
 
-        extra_aggregations = self.dependency_aggregations.get(sort_field, [])
-        required_aggregations = set([sort_field, "total"] + extra_aggregations)
-        for h in having:
-            alias = h[0]
-            required_aggregations.add(alias)
+        required_aggregations = {sort_field, "total"}
+        required_aggregations.update(self.dependency_aggregations.get(sort_field, ()))
+        required_aggregations.update(h[0] for h in having)
 
         aggregations = []
         for alias in required_aggregations:
-            aggregation = self.aggregation_defs[alias]
-            if callable(aggregation):
-                # TODO: If we want to expand this pattern we should probably figure out
-                # more generic things to pass here.
-                aggregation = aggregation(start, end)
-            aggregations.append(aggregation + [alias])
+            aggregation = self.compiled_aggregation_defs.get(alias)
+            if aggregation is not None:
+                # The query is modified in place before it's sent to Snuba.
+                aggregation = list(aggregation)
+            else:
+                aggregation = self.aggregation_defs[alias]
+                if callable(aggregation):
+                    # TODO: If we want to expand this pattern we should probably figure out
+                    # more generic things to pass here.
+                    aggregation = aggregation(start, end)
+                aggregation = aggregation + [alias]
+            aggregations.append(aggregation)
 
         if cursor is not None:
             having.append((sort_field, ">=" if cursor.is_prev else "<=", cursor.value))
 
+        if keyset is not None:
+            # Rows are ordered by `-sort_field, group_id`, so the rows after the
+            # keyset are the ones with a lower score, or the same score and a
+            # higher group id.
+            last_score, last_group_id = keyset
+            having.append(
+                [
+                    [
+                        "or",
+                        [
+                            ["less", [sort_field, last_score]],
+                            [
+                                "and",
+                                [
+                                    ["equals", [sort_field, last_score]],
+                                    ["greater", ["group_id", last_group_id]],
+                                ],
+                            ],
+                        ],
+                    ],
+                    "=",
+                    1,
+                ]
+            )
+
         selected_columns = []
         if get_sample:
-            query_hash = md5(json.dumps(conditions).encode("utf-8")).hexdigest()[:8]
+            # This only needs to be a stable seed for picking the sample, so a
+            # fast non-cryptographic 32 bit hash will do.
+            query_hash = "{:08x}".format(
+                mmh3.hash(json.dumps(conditions).encode("utf-8")) & 0xFFFFFFFF
+            )
             selected_columns.append(
                 ("cityHash64", ("'{}'".format(query_hash), "group_id"), "sample")
             )
@@ -182,7 +296,7 @@ class AbstractQueryExecutor:
             ]  # ensure stable sort within the same score
             referrer = "search"
 
-        snuba_results = snuba.aliased_query(
+        return dict(
             dataset=self.dataset,
             start=start,
             end=end,
@@ -201,13 +315,41 @@ class AbstractQueryExecutor:
             sample=1,  # Don't use clickhouse sampling, even when in turbo mode.
             condition_resolver=snuba.get_snuba_column_name,
         )
+
+    def _build_conditions_and_having(self, search_filters, project_ids, environment_ids):
+        """
+        Converts `search_filters` into a tuple of the Snuba `(conditions, having)`
+        that they require.
+        """
+        conditions = []
+        having = []
+        for search_filter in search_filters:
+            # Don't filter on postgres fields here, they're not available, and
+            # we special case date
+            if search_filter.key.name in self.postgres_only_or_date_fields:
+                continue
+            converted_filter = convert_search_filter_to_snuba_query(search_filter)
+            converted_filter = self._transform_converted_filter(
+                search_filter, converted_filter, project_ids, environment_ids
+            )
+            if converted_filter is not None:
+                # Ensure that no user-generated tags that clashes with aggregation_defs is added to having
+                if search_filter.key.name in self.aggregation_defs and not search_filter.key.is_tag:
+                    having.append(converted_filter)
+                else:
+                    conditions.append(converted_filter)
+        return conditions, having
+
+    def _get_snuba_search_results(self, snuba_results, sort_field, get_sample):
         rows = snuba_results["data"]
         total = snuba_results["totals"]["total"]
 
-        if not get_sample:
+        if get_sample:
+            sort_field = "sample"
+        else:
             metrics.timing("snuba.search.num_result_groups", len(rows))
 
-        return [(row["group_id"], row[sort_field]) for row in rows], total
+        return list(map(itemgetter("group_id", sort_field), rows)), total
 
     def _transform_converted_filter(
         self, search_filter, converted_filter, project_ids, environment_ids=None
@@ -255,6 +397,7 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
             "first_seen",
         ]
     )
+    postgres_only_or_date_fields = frozenset(postgres_only_fields | {"date"})
     sort_strategies = {
         "date": "last_seen",
         "freq": "times_seen",
@@ -275,6 +418,11 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
         "user_count": ["uniq", "tags[sentry:user]"],
         "trend": trend_aggregation,
     }
+    compiled_aggregation_defs = {
+        alias: tuple(aggregation + [alias])
+        for alias, aggregation in six.iteritems(aggregation_defs)
+        if not callable(aggregation)
+    }
 
     @property
     def dataset(self):
@@ -298,10 +446,10 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
     ):
 
         now = timezone.now()
-        end = None
-        end_params = [_f for _f in [date_to, get_search_filter(search_filters, "date", "<")] if _f]
-        if end_params:
-            end = min(end_params)
+        date_filter_start, date_filter_end = get_date_bounds(search_filters)
+        end = date_to
+        if date_filter_end and (not end or date_filter_end < end):
+            end = date_filter_end
 
         if not end:
             end = now + ALLOWED_FUTURE_DELTA
@@ -315,11 +463,7 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
                 and sort_by == "date"
                 and
                 # This handles tags and date parameters for search filters.
-                not [
-                    sf
-                    for sf in search_filters
-                    if sf.key.name not in self.postgres_only_fields.union(["date"])
-                ]
+                all(sf.key.name in self.postgres_only_or_date_fields for sf in search_filters)
             ):
                 group_queryset = group_queryset.order_by("-last_seen")
                 paginator = DateTimePaginator(group_queryset, "-last_seen", **paginator_options)
@@ -330,12 +474,16 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
         # retention date, which may be closer than 90 days in the past, but
         # apparently `retention_window_start` can be None(?), so we need a
         # fallback.
-        retention_date = max(
-            [_f for _f in [retention_window_start, now - timedelta(days=90)] if _f]
-        )
-        start_params = [date_from, retention_date, get_search_filter(search_filters, "date", ">")]
-        start = max([_f for _f in start_params if _f])
-        end = max([retention_date, end])
+        retention_date = now - timedelta(days=90)
+        if retention_window_start and retention_window_start > retention_date:
+            retention_date = retention_window_start
+        start = retention_date
+        if date_from and date_from > start:
+            start = date_from
+        if date_filter_start and date_filter_start > start:
+            start = date_filter_start
+        if retention_date > end:
+            end = retention_date
 
         if start == retention_date and end == retention_date:
             # Both `start` and `end` must have been trimmed to `retention_date`,
@@ -356,6 +504,10 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
         max_candidates = options.get("snuba.search.max-pre-snuba-candidates")
 
         with sentry_sdk.start_span(op="snuba_group_query") as span:
+            # The slice is applied as a LIMIT, so Postgres stops after
+            # `max_candidates + 1` rows. We fetch them in one go rather than
+            # with `.iterator()`, which would use a server side cursor and need
+            # a round trip for every 100 rows.
             group_ids = list(group_queryset.values_list("id", flat=True)[: max_candidates + 1])
             span.set_data("Max Candidates", max_candidates)
             span.set_data("Result Size", len(group_ids))
@@ -379,39 +531,92 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
             metrics.incr("snuba.search.too_many_candidates", skip_internal=False)
             too_many_candidates = True
             group_ids = []
+        else:
+            # Sort the candidates once here rather than for every chunk we
+            # send to Snuba.
+            group_ids.sort()
 
         sort_field = self.sort_strategies[sort_by]
         chunk_growth = options.get("snuba.search.chunk-growth-rate")
         max_chunk_size = options.get("snuba.search.max-chunk-size")
         chunk_limit = limit
-        offset = 0
+        keyset = None
         num_chunks = 0
-        hits = self.calculate_hits(
-            group_ids,
-            too_many_candidates,
-            sort_field,
-            projects,
-            retention_window_start,
-            group_queryset,
-            environments,
-            sort_by,
-            limit,
-            cursor,
-            count_hits,
-            paginator_options,
-            search_filters,
-            start,
-            end,
+        project_ids = [p.id for p in projects]
+        environment_ids = environments and [environment.id for environment in environments]
+        # every Snuba query here searches with the same filters, so only
+        # convert them once
+        conditions_and_having = self._build_conditions_and_having(
+            search_filters, project_ids, environment_ids
+        )
+        search_kwargs = dict(
+            start=start,
+            end=end,
+            project_ids=project_ids,
+            environment_ids=environment_ids,
+            sort_field=sort_field,
+            cursor=cursor,
+            group_ids=group_ids,
+            search_filters=search_filters,
+            conditions_and_having=conditions_and_having,
         )
-        if count_hits and hits == 0:
-            return self.empty_result
 
-        paginator_results = self.empty_result
+        hits = None
+        hits_sample = None
+        hits_cache_key = None
+        hits_cache_ttl = options.get("snuba.search.hits-cache-ttl")
+        if hits_cache_ttl and count_hits and (too_many_candidates or cursor is not None):
+            # Estimating hits is expensive and only approximate anyway, so an
+            # estimate for the same search can be reused for a short while.
+            # Estimates of 0 aren't cached, as they'd hide every result until
+            # they expire.
+            hits_cache_key = self._get_hits_cache_key(
+                too_many_candidates,
+                project_ids,
+                environment_ids,
+                search_filters,
+                start,
+                end,
+                hits_cache_ttl,
+            )
+            hits = cache.get(hits_cache_key)
+
+        if hits is None:
+            # The sample query used to estimate hits doesn't depend on the
+            # chunks, so it runs in Snuba while we fetch the first one.
+            hits_sample = self.get_hits_sample(
+                group_ids,
+                too_many_candidates,
+                sort_field,
+                project_ids,
+                environment_ids,
+                cursor,
+                count_hits,
+                search_filters,
+                start,
+                end,
+                conditions_and_having=conditions_and_having,
+            )
+
+        paginator_results = None
         result_groups = []
         result_group_ids = set()
 
+        def get_paginator_results():
+            return SequencePaginator(
+                [(score, id) for (id, score) in result_groups], reverse=True, **paginator_options
+            ).get_result(limit, cursor, known_hits=hits, max_hits=max_hits)
+
         max_time = options.get("snuba.search.max-total-chunk-time-seconds")
-        time_start = time.time()
+        deadline = time.monotonic() + max_time
+
+        # When post-filtering, the next chunk can be fetched from Snuba while
+        # the current one is being post-filtered in Postgres.
+        next_chunk = None
+        num_post_filtered = 0
+        # ids of every group that passes post-filtering, if we fetched them
+        fetch_post_filter_ids = True
+        post_filter_ids = None
 
         # Do smaller searches in chunks until we have enough results
         # to answer the query (or hit the end of possible results). We do
@@ -419,36 +624,57 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
         # sorted by `last_seen`, and we want to avoid returning all of
         # a project's groups and then post-sorting them all in Postgres
         # when typically the first N results will do.
-        while (time.time() - time_start) < max_time:
+        while time.monotonic() < deadline:
             num_chunks += 1
 
-            # grow the chunk size on each iteration to account for huge projects
-            # and weird queries, up to a max size
-            chunk_limit = min(int(chunk_limit * chunk_growth), max_chunk_size)
-            # but if we have group_ids always query for at least that many items
-            chunk_limit = max(chunk_limit, len(group_ids))
+            if next_chunk is not None:
+                snuba_groups, total = next_chunk.result()
+                next_chunk = None
+            else:
+                # grow the chunk size on each iteration to account for huge projects
+                # and weird queries, up to a max size
+                chunk_limit = min(int(chunk_limit * chunk_growth), max_chunk_size)
+                # but if we have group_ids always query for at least that many items
+                chunk_limit = max(chunk_limit, len(group_ids))
+
+                snuba_groups, total = self.snuba_search(
+                    limit=chunk_limit, keyset=keyset, **search_kwargs
+                )
+
+            if hits_sample is not None:
+                # The sample ran in Snuba alongside this first chunk. If it
+                # shows that nothing matches, don't fetch any more chunks.
+                hits = self.calculate_hits(hits_sample, group_queryset)
+                hits_sample = None
+                if hits and hits_cache_key is not None:
+                    cache.set(hits_cache_key, hits, hits_cache_ttl)
+                if hits == 0:
+                    return self.empty_result
 
-            # {group_id: group_score, ...}
-            snuba_groups, total = self.snuba_search(
-                start=start,
-                end=end,
-                project_ids=[p.id for p in projects],
-                environment_ids=environments and [environment.id for environment in environments],
-                sort_field=sort_field,
-                cursor=cursor,
-                group_ids=group_ids,
-                limit=chunk_limit,
-                offset=offset,
-                search_filters=search_filters,
-            )
             metrics.timing("snuba.search.num_snuba_results", len(snuba_groups))
             count = len(snuba_groups)
-            more_results = count >= limit and (offset + limit) < total
-            offset += len(snuba_groups)
+            # `total` only counts the rows after the keyset, so there are more
+            # results if Snuba matched more rows than it returned in this chunk.
+            more_results = count >= limit and count < total
 
             if not snuba_groups:
                 break
 
+            # Continue the next chunk from the last row of this one.
+            last_group_id, last_score = snuba_groups[-1]
+            keyset = (last_score, last_group_id)
+
+            if not group_ids and more_results and num_post_filtered:
+                # If the share of groups that passed post-filtering so far
+                # suggests that this chunk won't fill the page, start fetching
+                # the next one while we post-filter this one.
+                pass_rate = len(result_groups) / float(num_post_filtered)
+                if len(result_groups) + count * pass_rate < limit:
+                    chunk_limit = min(int(chunk_limit * chunk_growth), max_chunk_size)
+                    next_chunk = self.snuba_search_async(
+                        limit=chunk_limit, keyset=keyset, **search_kwargs
+                    )
+
             if group_ids:
                 # pre-filtered candidates were passed down to Snuba, so we're
                 # finished with filtering and these are the only results. Note
@@ -456,17 +682,47 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
                 # the group_ids, we know we got all of them (ie there are
                 # no more chunks after the first)
                 result_groups = snuba_groups
-                if count_hits and hits is None:
+                if count_hits and hits is None and hits_sample is None:
                     hits = len(snuba_groups)
             else:
                 # pre-filtered candidates were *not* passed down to Snuba,
                 # so we need to do post-filtering to verify Sentry DB predicates
-                filtered_group_ids = group_queryset.filter(
-                    id__in=[gid for gid, _ in snuba_groups]
-                ).values_list("id", flat=True)
+                if fetch_post_filter_ids and num_post_filtered:
+                    # This search needs more than one chunk, so rather than
+                    # checking every further chunk against Postgres, fetch the
+                    # ids of all groups that pass the filters once if there
+                    # aren't too many of them. Only try when the hits, or the
+                    # share of groups that passed so far, suggest they fit.
+                    fetch_post_filter_ids = False
+                    max_post_filter_ids = options.get("snuba.search.max-postfilter-set-size")
+                    if hits is not None:
+                        expected_post_filter_ids = hits
+                    else:
+                        expected_post_filter_ids = (
+                            len(result_groups)
+                            * (num_post_filtered + total)
+                            / float(num_post_filtered)
+                        )
+                    if expected_post_filter_ids <= max_post_filter_ids:
+                        valid_group_ids = list(
+                            group_queryset.values_list("id", flat=True)[: max_post_filter_ids + 1]
+                        )
+                        if len(valid_group_ids) <= max_post_filter_ids:
+                            post_filter_ids = set(valid_group_ids)
+
+                if post_filter_ids is not None:
+                    filtered_group_ids = post_filter_ids
+                else:
+                    filtered_group_ids = set(
+                        group_queryset.filter(id__in=[gid for gid, _ in snuba_groups]).values_list(
+                            "id", flat=True
+                        )
+                    )
+
+                for group_id, group_score in snuba_groups:
+                    if group_id not in filtered_group_ids:
+                        continue
 
-                group_to_score = dict(snuba_groups)
-                for group_id in filtered_group_ids:
                     if group_id in result_group_ids:
                         # because we're doing multiple Snuba queries, which
                         # happen outside of a transaction, there is a small possibility
@@ -474,23 +730,42 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
                         # so we at least want to protect against duplicates
                         continue
 
-                    group_score = group_to_score[group_id]
                     result_group_ids.add(group_id)
                     result_groups.append((group_id, group_score))
+                num_post_filtered += count
 
             # break the query loop for one of three reasons:
             # * we started with Postgres candidates and so only do one Snuba query max
             # * the paginator is returning enough results to satisfy the query (>= the limit)
             # * there are no more groups in Snuba to post-filter
-            # TODO do we actually have to rebuild this SequencePaginator every time
-            # or can we just make it after we've broken out of the loop?
-            paginator_results = SequencePaginator(
-                [(score, id) for (id, score) in result_groups], reverse=True, **paginator_options
-            ).get_result(limit, cursor, known_hits=hits, max_hits=max_hits)
-
-            if group_ids or len(paginator_results.results) >= limit or not more_results:
+            if group_ids or not more_results:
                 break
 
+            # The paginator can't return more results than we've collected, so
+            # only build it to check once we might have enough of them.
+            if len(result_groups) >= limit:
+                paginator_results = get_paginator_results()
+                if len(paginator_results.results) >= limit:
+                    break
+                paginator_results = None
+
+        if next_chunk is not None:
+            # We stopped before using the chunk that was fetched ahead of time.
+            # This only drops its Snuba request if it is still queued, one that
+            # is already running finishes and its results are ignored.
+            next_chunk.cancel()
+
+        if hits_sample is not None:
+            # We ran out of time before fetching the first chunk.
+            hits = self.calculate_hits(hits_sample, group_queryset)
+            if hits and hits_cache_key is not None:
+                cache.set(hits_cache_key, hits, hits_cache_ttl)
+            if hits == 0:
+                return self.empty_result
+
+        if paginator_results is None:
+            paginator_results = get_paginator_results()
+
         # HACK: We're using the SequencePaginator to mask the complexities of going
         # back and forth between two databases. This causes a problem with pagination
         # because we're 'lying' to the SequencePaginator (it thinks it has the entire
@@ -513,34 +788,76 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
         metrics.timing("snuba.search.num_chunks", num_chunks)
 
         groups = Group.objects.in_bulk(paginator_results.results)
-        paginator_results.results = [groups[k] for k in paginator_results.results if k in groups]
+        paginator_results.results = [
+            group
+            for group in (groups.get(k) for k in paginator_results.results)
+            if group is not None
+        ]
 
         return paginator_results
 
-    def calculate_hits(
+    def _get_hits_cache_key(
+        self, too_many_candidates, project_ids, environment_ids, search_filters, start, end, ttl
+    ):
+        """
+        Builds the cache key of the hits estimate for a search from the inputs
+        that the group queryset and the Snuba query are built from. Times,
+        including relative ones like `age:-24h` that were resolved against the
+        current time, are rounded down to multiples of `ttl`, so that searches
+        over a window that moves with the current time share their estimate.
+        Models in filter values, like the user of `assigned_to:me`, are keyed
+        by their id.
+        """
+
+        def stable_value(value):
+            if isinstance(value, (list, tuple)):
+                return [stable_value(v) for v in value]
+            if isinstance(value, datetime):
+                return int(to_timestamp(value)) // ttl
+            if isinstance(value, Model):
+                return (type(value).__name__, value.pk)
+            return value
+
+        filters = sorted(
+            repr((sf.key.name, sf.operator, stable_value(sf.value.raw_value)))
+            for sf in search_filters
+        )
+        return u"search:hits:{}".format(
+            md5_text(
+                repr(
+                    (
+                        too_many_candidates,
+                        project_ids,
+                        environment_ids,
+                        filters,
+                        stable_value(start),
+                        stable_value(end),
+                    )
+                )
+            ).hexdigest()
+        )
+
+    def get_hits_sample(
         self,
         group_ids,
         too_many_candidates,
         sort_field,
-        projects,
-        retention_window_start,
-        group_queryset,
-        environments,
-        sort_by,
-        limit,
+        project_ids,
+        environment_ids,
         cursor,
         count_hits,
-        paginator_options,
         search_filters,
         start,
         end,
+        conditions_and_having=None,
     ):
         """
-        This method should return an integer representing the number of hits (results) of your search.
-        It will return 0 if hits were calculated and there are none.
-        It will return None if hits were not calculated.
+        Starts the Snuba query for the sample of groups that `calculate_hits`
+        estimates the number of hits from, and returns a future of its results.
+        It will return None if hits don't need to be estimated.
+        `conditions_and_having` is passed on to `snuba_search`.
         """
-        if count_hits is False:
+        if not count_hits:
             return None
         elif too_many_candidates or cursor is not None:
             # If we had too many candidates to reasonably pass down to snuba,
@@ -579,29 +896,39 @@ class PostgresSnubaQueryExecutor(AbstractQueryExecutor):
             kwargs = dict(
                 start=start,
                 end=end,
-                project_ids=[p.id for p in projects],
-                environment_ids=environments and [environment.id for environment in environments],
+                project_ids=project_ids,
+                environment_ids=environment_ids,
                 sort_field=sort_field,
                 limit=sample_size,
                 offset=0,
                 get_sample=True,
                 search_filters=search_filters,
+                conditions_and_having=conditions_and_having,
             )
             if not too_many_candidates:
                 kwargs["group_ids"] = group_ids
 
-            snuba_groups, snuba_total = self.snuba_search(**kwargs)
-            snuba_count = len(snuba_groups)
-            if snuba_count == 0:
-                # Maybe check for 0 hits and return EMPTY_RESULT in ::query? self.empty_result
-                return 0
-            else:
-                filtered_count = group_queryset.filter(
-                    id__in=[gid for gid, _ in snuba_groups]
-                ).count()
-
-                hit_ratio = filtered_count / float(snuba_count)
-                hits = int(hit_ratio * snuba_total)
-                return hits
+            return self.snuba_search_async(**kwargs)
 
         return None
+
+    def calculate_hits(self, hits_sample, group_queryset):
+        """
+        This method should return an integer representing the number of hits (results) of your search.
+        It will return 0 if hits were calculated and there are none.
+        It will return None if hits were not calculated.
+        :param hits_sample: future of the sample query as returned by `get_hits_sample`
+        """
+        if hits_sample is None:
+            return None
+
+        snuba_groups, snuba_total = hits_sample.result()
+        snuba_count = len(snuba_groups)
+        if snuba_count == 0:
+            return 0
+        else:
+            filtered_count = group_queryset.filter(id__in=[gid for gid, _ in snuba_groups]).count()
+
+            hit_ratio = filtered_count / float(snuba_count)
+            hits = int(hit_ratio * snuba_total)
+            return hits
@@ -11,12 +11,13 @@ import os
 import pytz
 import re
 import six
+import threading
 import time
 import urllib3
 import sentry_sdk
 from sentry_sdk import Hub
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from django.conf import settings
 from six.moves.urllib.parse import urlparse
 
@@ -318,6 +319,12 @@ _snuba_pool = connection_from_url(
     maxsize=10,
 )
 _query_thread_pool = ThreadPoolExecutor(max_workers=10)
+# `raw_query_async` has its own pool, so its requests don't wait behind bulk
+# queries. It only hands a request to the pool if a worker is free, and runs it
+# on the calling thread otherwise.
+_ASYNC_QUERY_WORKERS = 10
+_async_query_thread_pool = ThreadPoolExecutor(max_workers=_ASYNC_QUERY_WORKERS)
+_async_query_slots = threading.BoundedSemaphore(_ASYNC_QUERY_WORKERS)
 
 
 epoch_naive = datetime(1970, 1, 1, tzinfo=None)
@@ -641,13 +648,52 @@ def raw_query(
     return bulk_raw_query([snuba_params], referrer=referrer)[0]
 
 
+def raw_query_async(referrer=None, **kwargs):
+    """
+    Like `raw_query`, and takes the same params, but returns a
+    `concurrent.futures.Future` for the results instead of waiting for them.
+    The query is still prepared on the calling thread, as that may need to hit
+    the database, and only the request to Snuba is made from a thread pool.
+
+    The request is never queued behind others. If every worker of the pool is
+    busy, it is made on the calling thread and the returned future is already
+    done.
+    """
+    query_params = _prepare_query_params(SnubaQueryParams(**kwargs))
+
+    if not _async_query_slots.acquire(False):
+        future = Future()
+        try:
+            future.set_result(_bulk_snuba_query([query_params], referrer=referrer)[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    thread_hub = Hub(Hub.current)
+
+    def run():
+        with thread_hub:
+            return _bulk_snuba_query([query_params], referrer=referrer)[0]
+
+    try:
+        future = _async_query_thread_pool.submit(run)
+    except Exception:
+        _async_query_slots.release()
+        raise
+    # Also frees the slot of a request that was cancelled before it started.
+    future.add_done_callback(lambda f: _async_query_slots.release())
+    return future
+
+
 def bulk_raw_query(snuba_param_list, referrer=None):
+    return _bulk_snuba_query(map(_prepare_query_params, snuba_param_list), referrer=referrer)
+
+
+def _bulk_snuba_query(query_param_list, referrer=None):
     headers = {}
     if referrer:
         headers["referer"] = referrer
 
-    query_param_list = map(_prepare_query_params, snuba_param_list)
-
     def snuba_query(params):
         query_params, forward, reverse, thread_hub = params
         try:
@@ -673,10 +719,10 @@ def bulk_raw_query(snuba_param_list, referrer=None):
 
     with sentry_sdk.start_span(
         op="start_snuba_query",
-        description=u"running {} snuba queries".format(len(snuba_param_list)),
+        description=u"running {} snuba queries".format(len(query_param_list)),
     ) as span:
         span.set_tag("referrer", headers.get("referer", "<unknown>"))
-        if len(snuba_param_list) > 1:
+        if len(query_param_list) > 1:
             query_results = list(
                 _query_thread_pool.map(
                     snuba_query, [params + (Hub(Hub.current),) for params in query_param_list]
@@ -919,10 +965,19 @@ def aliased_query(**kwargs):
     sentry.tagstore, or sentry.snuba.discover instead when reading data.
     """
     with sentry_sdk.start_span(op="sentry.snuba.aliased_query"):
-        return _aliased_query_impl(**kwargs)
+        return raw_query(**_aliased_query_params(**kwargs))
+
+
+def aliased_query_async(**kwargs):
+    """
+    Like `aliased_query`, but returns a `concurrent.futures.Future` for the
+    results instead of waiting for them. See `raw_query_async`.
+    """
+    with sentry_sdk.start_span(op="sentry.snuba.aliased_query"):
+        return raw_query_async(**_aliased_query_params(**kwargs))
 
 
-def _aliased_query_impl(
+def _aliased_query_params(
     start=None,
     end=None,
     groupby=None,
@@ -975,7 +1030,7 @@ def _aliased_query_impl(
             updated_order.append(u"{}{}".format("-" if order.startswith("-") else "", order_field))
         orderby = updated_order
 
-    return raw_query(
+    return dict(
         start=start,
         end=end,
         groupby=groupby,
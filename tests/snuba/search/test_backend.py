@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 import uuid
 
+from concurrent.futures import Future
 from sentry.utils.compat import mock
 import pytz
 from datetime import datetime, timedelta
 from django.utils import timezone
+from freezegun import freeze_time
 from hashlib import md5
 
 from sentry import options
@@ -20,9 +22,16 @@ from sentry.models import (
     Integration,
 )
 from sentry.search.snuba.backend import EventsDatasetSnubaSearchBackend
+from sentry.search.snuba.executors import PostgresSnubaQueryExecutor
 from sentry.testutils import SnubaTestCase, TestCase, xfail_if_not_postgres
 from sentry.testutils.helpers.datetime import before_now, iso_format
-from sentry.utils.snuba import Dataset, SENTRY_SNUBA_MAP, SnubaError
+from sentry.utils.snuba import (
+    Dataset,
+    SENTRY_SNUBA_MAP,
+    SnubaError,
+    raw_query,
+    raw_query_async,
+)
 
 
 def date_to_query_format(date):
@@ -1163,6 +1172,165 @@ class EventsSnubaSearchTest(TestCase, SnubaTestCase):
             assert third_results.hits > 10
             assert third_results.results != second_results.results
 
+    def test_hits_estimate_cache(self):
+        for i in range(10):
+            self.store_event(
+                data={
+                    "fingerprint": ["put-me-in-group{}".format(i)],
+                    "timestamp": iso_format(self.base_datetime - timedelta(days=21)),
+                    "tags": {"match": "{}".format(i % 2)},
+                },
+                project_id=self.project.id,
+            )
+
+        # The retention window starts at the current time, so the second query
+        # has to reuse the estimate even though it runs a second later.
+        now = timezone.now().replace(minute=10, second=0, microsecond=0)
+        with self.options(
+            {
+                # Too small to pass all django candidates down to snuba
+                "snuba.search.max-pre-snuba-candidates": 1,
+                "snuba.search.hits-cache-ttl": 3600,
+                "system.event-retention-days": 90,
+            }
+        ):
+            with freeze_time(now):
+                first_results = self.make_query(
+                    search_filter_query="is:unresolved match:1", limit=2, count_hits=True
+                )
+            assert first_results.hits > 0
+
+            with mock.patch(
+                "sentry.search.snuba.executors.PostgresSnubaQueryExecutor.get_hits_sample",
+                return_value=None,
+            ) as get_hits_sample, freeze_time(now + timedelta(seconds=1)):
+                second_results = self.make_query(
+                    search_filter_query="is:unresolved match:1", limit=2, count_hits=True
+                )
+                assert not get_hits_sample.called
+                assert second_results.hits == first_results.hits
+
+                self.make_query(
+                    search_filter_query="is:unresolved match:0", limit=2, count_hits=True
+                )
+                assert get_hits_sample.called
+
+    def test_chunks_with_equal_scores(self):
+        # Every group has a single event, so they all have the same
+        # `times_seen` and only the group id tells apart where a chunk ended.
+        project = self.create_project()
+        groups = []
+        for i in range(12):
+            event = self.store_event(
+                data={
+                    "fingerprint": ["put-me-in-group{}".format(i)],
+                    "timestamp": iso_format(self.base_datetime),
+                },
+                project_id=project.id,
+            )
+            group = event.group
+            # Post-filtering drops every other group, so the first chunk
+            # can't fill the page on its own.
+            group.status = GroupStatus.UNRESOLVED if i % 2 == 0 else GroupStatus.RESOLVED
+            group.save()
+            groups.append(group)
+        group_ids = sorted(group.id for group in groups)
+
+        with self.options(
+            {
+                # Too small to pass all django candidates down to snuba
+                "snuba.search.max-pre-snuba-candidates": 1
+            }
+        ), mock.patch("sentry.utils.snuba.raw_query", wraps=raw_query) as query_mock:
+            results = self.make_query(
+                projects=[project], search_filter_query="is:unresolved", sort_by="freq", limit=6
+            )
+
+        result_ids = [group.id for group in results]
+        assert len(result_ids) == len(set(result_ids))
+        assert set(result_ids) == set(
+            group.id for group in groups if group.status == GroupStatus.UNRESOLVED
+        )
+
+        # The first chunk holds 9 of the 12 groups, the second one continues
+        # after the last of them.
+        assert query_mock.call_count == 2
+        assert query_mock.call_args_list[0][1]["having"] == []
+        assert query_mock.call_args_list[1][1]["having"] == [
+            [
+                [
+                    "or",
+                    [
+                        ["less", ["times_seen", 1]],
+                        [
+                            "and",
+                            [
+                                ["equals", ["times_seen", 1]],
+                                ["greater", ["group_id", group_ids[8]]],
+                            ],
+                        ],
+                    ],
+                ],
+                "=",
+                1,
+            ]
+        ]
+
+    def test_prefetched_chunk(self):
+        # Only every fifth group passes post-filtering, so it takes four
+        # chunks of three groups to fill the page.
+        project = self.create_project()
+        groups = []
+        for i in range(20):
+            event = self.store_event(
+                data={
+                    "fingerprint": ["put-me-in-group{}".format(i)],
+                    "timestamp": iso_format(self.base_datetime - timedelta(minutes=i)),
+                },
+                project_id=project.id,
+            )
+            group = event.group
+            group.status = GroupStatus.UNRESOLVED if i % 5 == 0 else GroupStatus.RESOLVED
+            group.save()
+            groups.append(group)
+
+        with self.options(
+            {
+                # Too small to pass all django candidates down to snuba
+                "snuba.search.max-pre-snuba-candidates": 1,
+                "snuba.search.chunk-growth-rate": 1.0,
+                "snuba.search.max-chunk-size": 3,
+            }
+        ), mock.patch("sentry.utils.snuba.raw_query", wraps=raw_query) as query_mock, mock.patch(
+            "sentry.utils.snuba.raw_query_async", wraps=raw_query_async
+        ) as query_async_mock:
+            results = self.make_query(
+                projects=[project], search_filter_query="is:unresolved", sort_by="date", limit=3
+            )
+
+        assert list(results) == [groups[0], groups[5], groups[10]]
+
+        # The second chunk only has one group that passes, so the third chunk
+        # is fetched while it's post-filtered, and the fourth one continues
+        # after the last group of the third.
+        assert query_async_mock.call_count == 1
+        assert query_mock.call_count == 3
+        [[[_, [_, [_, [_, after_group]]]], _, _]] = query_mock.call_args_list[2][1]["having"]
+        assert after_group == ["greater", ["group_id", groups[8].id]]
+
+    def test_cancel_snuba_search_async(self):
+        executor = PostgresSnubaQueryExecutor()
+        snuba_future = Future()
+        with mock.patch.object(executor, "_get_snuba_search_query", return_value={}), mock.patch(
+            "sentry.utils.snuba.aliased_query_async", return_value=snuba_future
+        ):
+            result = executor.snuba_search_async(sort_field="last_seen")
+
+        # The Snuba request hasn't started yet, so it's dropped along with
+        # the result.
+        assert result.cancel()
+        assert snuba_future.cancelled()
+
     def test_first_release(self):
 
         # expect no groups within the results since there are no releases
@@ -10,6 +10,7 @@ from django.utils import timezone
 from sentry.testutils import SnubaTestCase, TestCase
 from sentry.testutils.helpers.datetime import iso_format, before_now
 from sentry.utils import snuba
+from sentry.utils.compat import mock
 
 
 class SnubaTest(TestCase, SnubaTestCase):
@@ -141,3 +142,50 @@ class BulkRawQueryTest(TestCase, SnubaTestCase):
             {"issue": event_1.group.id, "event_id": event_1.event_id},
             {"issue": event_2.group.id, "event_id": event_2.event_id},
         ]
+
+
+class RawQueryAsyncTest(TestCase, SnubaTestCase):
+    def test_simple(self):
+        one_min_ago = iso_format(before_now(minutes=1))
+        event = self.store_event(
+            data={"fingerprint": ["group-1"], "message": "hello", "timestamp": one_min_ago},
+            project_id=self.project.id,
+        )
+
+        future = snuba.raw_query_async(
+            start=timezone.now() - timedelta(days=1),
+            end=timezone.now(),
+            selected_columns=["event_id", "group_id", "timestamp"],
+            filter_keys={"project_id": [self.project.id], "group_id": [event.group.id]},
+        )
+        result = future.result()
+        assert [{"issue": r["group_id"], "event_id": r["event_id"]} for r in result["data"]] == [
+            {"issue": event.group.id, "event_id": event.event_id}
+        ]
+
+    def test_pool_busy(self):
+        one_min_ago = iso_format(before_now(minutes=1))
+        event = self.store_event(
+            data={"fingerprint": ["group-1"], "message": "hello", "timestamp": one_min_ago},
+            project_id=self.project.id,
+        )
+
+        # Every worker is busy, so the query runs on this thread instead.
+        with mock.patch.object(snuba, "_async_query_slots") as slots, mock.patch.object(
+            snuba, "_async_query_thread_pool"
+        ) as pool:
+            slots.acquire.return_value = False
+            future = snuba.raw_query_async(
+                start=timezone.now() - timedelta(days=1),
+                end=timezone.now(),
+                selected_columns=["event_id", "group_id", "timestamp"],
+                filter_keys={"project_id": [self.project.id], "group_id": [event.group.id]},
+            )
+            assert future.done()
+            assert not pool.submit.called
+            assert not slots.release.called
+
+        result = future.result()
+        assert [{"issue": r["group_id"], "event_id": r["event_id"]} for r in result["data"]] == [
+            {"issue": event.group.id, "event_id": event.event_id}
+        ]